@@ -0,0 +1,12 @@
+
+# Country groups shared by the preprocessor (region totals) and the Streamlit app (presets, map).
+EU = frozenset({"Austria","Belgium","Bulgaria","Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia",
+                "Finland","France","Germany","Greece","Hungary","Ireland","Italy","Latvia","Lithuania","Luxembourg",
+                "Malta","Netherlands","Poland","Portugal","Romania","Slovakia","Slovenia","Spain","Sweden"})
+EEA_PLUS_UK = EU | {"Iceland","Liechtenstein","Norway","United Kingdom","UK"}
+EUROPE_WIDE = frozenset({"Albania","Andorra","Armenia","Austria","Azerbaijan","Belarus","Belgium","Bosnia and Herzegovina","Bulgaria",
+                         "Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia","Finland","France","Georgia","Germany","Greece",
+                         "Hungary","Iceland","Ireland","Italy","Kazakhstan","Kosovo","Latvia","Liechtenstein","Lithuania","Luxembourg",
+                         "Malta","Moldova","Monaco","Montenegro","Netherlands","North Macedonia","Norway","Poland","Portugal","Romania",
+                         "Russia","San Marino","Serbia","Slovakia","Slovenia","Spain","Sweden","Switzerland","Turkey","Ukraine",
+                         "United Kingdom","UK","Vatican City"})
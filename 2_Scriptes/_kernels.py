@@ -0,0 +1,26 @@
+
+# Numeric kernels for the Streamlit app. They live in an imported module so they are built
+# once per process: Streamlit re-executes the script on every rerun, which would otherwise
+# create a fresh Numba dispatcher (and reload it from the on-disk cache) each time.
+import numpy as np
+
+# Numba is optional; without it the preset ranking sums areas with np.bincount.
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except Exception:
+    HAS_NUMBA = False
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def sum_by_code(codes, values, n):
+        # Per-code sums, skipping NaN like groupby().sum()
+        out = np.zeros(n)
+        for i in range(codes.shape[0]):
+            v = values[i]
+            if v == v:
+                out[codes[i]] += v
+        return out
+else:
+    def sum_by_code(codes, values, n):
+        return np.bincount(codes, weights=np.nan_to_num(values), minlength=n)
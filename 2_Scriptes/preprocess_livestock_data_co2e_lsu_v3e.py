@@ -2,7 +2,18 @@
 from __future__ import annotations
 import argparse, re, sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from _constants import EU, EEA_PLUS_UK, EUROPE_WIDE
+
+# Numba is optional; without it the LSU stage falls back to NumPy broadcasting.
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except Exception:
+    HAS_NUMBA = False
 
 # ---------- Taxonomy (case-insensitive) ----------
 ALL_ANIMALS_LIST = [
@@ -19,42 +30,61 @@ ATOMIC_LIST = [
     "Ducks","Goats","Horses","Sheep"
 ]
 
+ALL_ANIMALS_SET = {s.lower() for s in ALL_ANIMALS_LIST}
+AGGREGATE_SET = {s.lower() for s in AGGREGATE_LIST}
+ATOMIC_SET = {s.lower() for s in ATOMIC_LIST}
+
 # EXCLUSIONS (matched case-insensitively on cleaned item label)
 EXCLUDE_ITEMS = {s.lower() for s in [
     "Chickens",            # already excluded earlier
     "Mules and hinnies"    # NEW: remove completely from analysis
 ]}
 
-EU = {"Austria","Belgium","Bulgaria","Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia",
-      "Finland","France","Germany","Greece","Hungary","Ireland","Italy","Latvia","Lithuania","Luxembourg",
-      "Malta","Netherlands","Poland","Portugal","Romania","Slovakia","Slovenia","Spain","Sweden"}
-EEA_PLUS_UK = EU.union({"Iceland","Liechtenstein","Norway","United Kingdom","UK"})
-EUROPE_WIDE = {"Albania","Andorra","Armenia","Austria","Azerbaijan","Belarus","Belgium","Bosnia and Herzegovina","Bulgaria",
-               "Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia","Finland","France","Georgia","Germany","Greece",
-               "Hungary","Iceland","Ireland","Italy","Kazakhstan","Kosovo","Latvia","Liechtenstein","Lithuania","Luxembourg",
-               "Malta","Moldova","Monaco","Montenegro","Netherlands","North Macedonia","Norway","Poland","Portugal","Romania",
-               "Russia","San Marino","Serbia","Slovakia","Slovenia","Spain","Sweden","Switzerland","Turkey","Ukraine",
-               "United Kingdom","UK","Vatican City"}
+CATTLE_RE = re.compile(r"cattle", re.I)
 
 def detect_year_cols(cols):
     return [c for c in cols if isinstance(c, str) and c.startswith("Y") and c[1:].isdigit()]
 
+# Raw CSV is streamed in blocks of about this many bytes
+CHUNK_BYTES = 64 << 20
+
+def read_chunks(path: Path, year_cols: list[str]):
+    """Yield the raw CSV as DataFrames: Area/Item/Element plus the year columns as float64.
+
+    float64 because head counts above 2**24 (poultry) are not exact in float32.
+    """
+    opts = pa_csv.ConvertOptions(
+        include_columns=["Area","Item","Element"] + year_cols,
+        column_types={"Area": pa.string(), "Item": pa.string(), "Element": pa.string(),
+                      **{c: pa.float64() for c in year_cols}})
+    with pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=CHUNK_BYTES),
+                         convert_options=opts) as reader:
+        for batch in reader:
+            yield batch.to_pandas()
+
+# Element keywords -> metric; exact labels are a dict hit, longer labels one regex scan.
+# When several keywords occur the earlier metric wins (Stocks, then CH4, then N2O).
+ELEMENT_KEYWORDS = {"stocks": "Stocks", "stock": "Stocks", "ch4": "CH4", "methane": "CH4",
+                    "n2o": "N2O", "nitrous": "N2O"}
+ELEMENT_RE = re.compile(r"\b(stock|ch4|methane|n2o|nitrous)\b")
+ELEMENT_PRIORITY = ["Stocks", "CH4", "N2O"]
+
 def normalize_element(e: str) -> str | None:
     if e is None: return None
     s = str(e).strip().lower()
-    if re.search(r"(^stocks?$|\bstock\b)", s, re.I): return "Stocks"
-    if re.search(r"\b(ch4|methane)\b", s, re.I):     return "CH4"
-    if re.search(r"\b(n2o|nitrous)\b", s, re.I):     return "N2O"
-    return None
+    hit = ELEMENT_KEYWORDS.get(s)
+    if hit: return hit
+    found = {ELEMENT_KEYWORDS[m] for m in ELEMENT_RE.findall(s)}
+    return next((m for m in ELEMENT_PRIORITY if m in found), None)
 
 def gwp_pair(name: str):
     return {"AR4":(25.0,298.0),"AR5":(28.0,265.0),"AR6_NOCCF":(27.2,273.0),"AR6_CCF":(29.8,273.0)}.get(name.strip().upper(), (27.2,273.0))
 
 def item_kind(label: str) -> str:
     lab = str(label).strip(); low = lab.lower()
-    if low in {x.lower() for x in ALL_ANIMALS_LIST}: return "all_animals"
-    if low in {x.lower() for x in AGGREGATE_LIST}:   return "aggregate"
-    if low in {x.lower() for x in ATOMIC_LIST}:      return "atomic"
+    if low in ALL_ANIMALS_SET: return "all_animals"
+    if low in AGGREGATE_SET:   return "aggregate"
+    if low in ATOMIC_SET:      return "atomic"
     return "atomic"
 
 def looks_like_cattle(name: str) -> bool:
@@ -77,6 +107,93 @@ def is_livestock_total_element(label: str) -> bool:
     s = str(label)
     return bool(re.search(r"livestock", s, re.I) and re.search(r"total", s, re.I))
 
+def classify(values: pd.Series, fn) -> pd.Series:
+    """Apply a per-label classifier once per unique value, then map it onto the rows."""
+    return values.map({v: fn(v) for v in values.unique()})
+
+def strip_labels(values: pd.Series) -> pd.Series:
+    """Stripped labels as a categorical; each distinct label is stripped once, not every row."""
+    col = values.astype("category")
+    codes, labels = pd.factorize(col.cat.categories.astype(str).str.strip(), sort=True)
+    row_codes = col.cat.codes.to_numpy()
+    row_codes = np.where(row_codes >= 0, codes[row_codes], -1)
+    return pd.Series(pd.Categorical.from_codes(row_codes, labels), index=values.index)
+
+def area_item_codes(frame: pd.DataFrame):
+    """One int64 code per (Area, Item) pair, from categorical Area and Item columns."""
+    return (frame["Area"].cat.codes.to_numpy(dtype=np.int64) * len(frame["Item"].cat.categories)
+            + frame["Item"].cat.codes.to_numpy(dtype=np.int64))
+
+def with_item_kind(keys: pd.DataFrame) -> pd.DataFrame:
+    """Add item_kind / is_all_animals / is_atomic to an (Area, Item) key frame."""
+    keys = keys.reset_index(drop=True)
+    keys["item_kind"] = classify(keys["Item"], item_kind).astype("category")
+    keys["is_all_animals"] = keys["item_kind"].eq("all_animals")
+    keys["is_atomic"] = keys["item_kind"].eq("atomic")
+    return keys
+
+def wide_to_long(keys: pd.DataFrame, values, years, metric: str, dtype=np.float32) -> pd.DataFrame:
+    """Melt a (rows x years) block into tidy rows (year-major, like DataFrame.melt).
+
+    Every output column is built from a 1-D array, so the frame never holds a row-major 2-D block.
+    """
+    n = len(keys)
+    long = keys.iloc[np.tile(np.arange(n), len(years))].reset_index(drop=True)
+    long["Year"] = np.repeat(years, n)
+    long["Value"] = values.ravel(order="F").astype(dtype)
+    long["Metric"] = pd.Categorical.from_codes(np.zeros(len(long), dtype=np.int8), [metric])
+    return long
+
+def as_float64(values) -> np.ndarray:
+    """Widen float32 through its shortest decimal repr: 1566.8016f becomes 1566.8016, not 1566.8016357421875."""
+    values = np.asarray(values)
+    if values.dtype != np.float32:
+        return values.astype(np.float64)
+    return values.astype(str).astype(np.float64)
+
+def concat_categorical(frames: list[pd.DataFrame], columns) -> pd.DataFrame:
+    """pd.concat that keeps `columns` categorical, over the union of each frame's labels."""
+    for c in columns:
+        parts = [f[c].astype("category") for f in frames]
+        dtype = pd.CategoricalDtype(sorted(set().union(*(p.cat.categories for p in parts))))
+        frames = [f.assign(**{c: p.astype(dtype)}) for f, p in zip(frames, parts)]
+    return pd.concat(frames, ignore_index=True)
+
+def sum_by_group(codes, values):
+    """Sum rows sharing a group code (NaN counts as 0, like groupby().sum()).
+
+    Returns the position of each group's first row and the (groups x years) sums.
+    """
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    sums = np.add.reduceat(np.nan_to_num(values[order]), starts, axis=0, dtype=np.float64)
+    return order[starts], sums
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _lsu_kernel(stocks, item_codes, main_factor, other_factor, cattle_rows):
+        n, ny = stocks.shape
+        main = np.empty((n, ny), dtype=np.float64)
+        other = np.empty((len(cattle_rows), ny), dtype=np.float64)
+        for i in prange(n):
+            f = main_factor[item_codes[i]]
+            for j in range(ny):
+                main[i, j] = stocks[i, j] * f
+        for k in prange(len(cattle_rows)):
+            i = cattle_rows[k]
+            f = other_factor[item_codes[i]]
+            for j in range(ny):
+                other[k, j] = stocks[i, j] * f
+        return main, other
+
+def lsu_values(stocks, item_codes, main_factor, other_factor, cattle_rows):
+    """LSU of every stock row (dairy share for cattle rows) and the non-dairy share of `cattle_rows`."""
+    if HAS_NUMBA:
+        return _lsu_kernel(stocks, item_codes, main_factor, other_factor, cattle_rows)
+    return (stocks * main_factor[item_codes][:, None],
+            stocks[cattle_rows] * other_factor[item_codes[cattle_rows]][:, None])
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True, help="Path to raw CSV (e.g., ...\\1_Donnees\\Emissions_*.csv)")
@@ -98,124 +215,160 @@ def main():
     outp = Path(args.output) if args.output else (inp.parent / "livestock_PREPARED_long.csv")
     outp.parent.mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(inp)
-
+    # Peek at the header only, so year columns can be given explicit types
+    header = pd.read_csv(inp, nrows=0).columns
     required = {"Area","Item","Element"}
-    missing = required.difference(df.columns)
+    missing = required.difference(header)
     if missing:
         sys.exit(f"ERROR: CSV missing columns: {', '.join(sorted(missing))}")
 
-    for c in ["Area","Item","Element"]:
-        df[c] = df[c].astype(str).str.strip()
-
-    # EXCLUDE specific Items entirely ("Chickens", "Mules and hinnies")
-    df = df[~df["Item"].str.strip().str.lower().isin(EXCLUDE_ITEMS)].copy()
-
-    year_cols = detect_year_cols(df.columns)
+    year_cols = detect_year_cols(header)
     if not year_cols:
         sys.exit("ERROR: No year columns found (expected 'Y2010', 'Y2018', etc.)")
 
-    df["ElementNorm"] = df["Element"].apply(normalize_element)
-    df = df[df["ElementNorm"].notna()].copy()
-
-    if only_lt:
-        mask_gases = df["ElementNorm"].isin(["CH4","N2O"])
-        lt_mask = df["Element"].apply(is_livestock_total_element)
-        df = df[(~mask_gases) | (mask_gases & lt_mask)].copy()
-
-    df["item_kind"] = df["Item"].apply(item_kind)
-    df["is_all_animals"] = df["item_kind"].eq("all_animals")
-    df["is_atomic"] = df["item_kind"].eq("atomic")
-
-    long = df.melt(id_vars=["Area","Item","Element","ElementNorm","item_kind","is_all_animals","is_atomic"],
-                   value_vars=year_cols, var_name="Year", value_name="Value")
-    long["Year"] = long["Year"].str[1:].astype(int)
+    years = np.array([int(c[1:]) for c in year_cols], dtype=np.int16)
+    ny = len(years)
+
+    # Stream the raw file: every chunk is filtered, its Stocks rows kept and its gas rows reduced
+    # straight away, so peak memory follows the filtered data instead of the whole input.
+    stock_parts, gas_parts = [], []
+    for chunk in read_chunks(inp, year_cols):
+        # Element only selects rows and the metric: classify it, then project to Area/Item + years
+        element_norm = classify(chunk["Element"], normalize_element).astype("category")
+        keep = element_norm.notna()
+        if only_lt:
+            mask_gases = element_norm.isin(["CH4","N2O"])
+            lt_mask = classify(chunk["Element"], is_livestock_total_element).astype(bool)
+            keep &= ~mask_gases | lt_mask
+        chunk = chunk.loc[keep, ["Area","Item"] + year_cols].copy()
+        element_norm = element_norm[keep]
+
+        # Low-cardinality labels as categoricals: groupbys, filters and the .copy() calls below
+        # then work on small int codes plus one shared dictionary per column
+        for c in ["Area","Item"]:
+            chunk[c] = strip_labels(chunk[c])
+
+        # EXCLUDE specific Items entirely ("Chickens", "Mules and hinnies")
+        excluded = classify(chunk["Item"], lambda x: x.strip().lower() in EXCLUDE_ITEMS).to_numpy(dtype=bool)
+        chunk = chunk[~excluded]
+        if chunk.empty:
+            continue
+
+        # Keep the chunk wide: one (rows x years) block, melted only per metric at the end
+        V = chunk[year_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        labels = chunk[["Area","Item"]]
+        elem = element_norm[~excluded]
+        stocks_mask = elem.eq("Stocks").to_numpy()
+        ch4_mask = elem.eq("CH4").to_numpy()
+        gas_mask = ch4_mask | elem.eq("N2O").to_numpy()
+
+        if stocks_mask.any():
+            stock_parts.append((labels[stocks_mask], V[stocks_mask]))
+
+        # Block columns: [CH4 x GWP | N2O x GWP | is-CH4 row | is-N2O row]; the last two count rows
+        # so each gas only yields groups it actually has (Total keeps the union, like the old outer merge).
+        if gas_mask.any():
+            is_ch4 = ch4_mask[gas_mask][:, None]
+            gas = np.nan_to_num(V[gas_mask]).astype(np.float32)
+            block = np.hstack([np.where(is_ch4, gas * GWP_CH4, 0), np.where(is_ch4, 0, gas * GWP_N2O), is_ch4, ~is_ch4])
+            first, sums = sum_by_group(area_item_codes(labels)[gas_mask], block)
+            gas_parts.append((labels[gas_mask].iloc[first], sums))
 
     prepared = []
 
     # Stocks
-    stocks = long[long["ElementNorm"]=="Stocks"][["Area","Item","Year","Value","item_kind","is_all_animals","is_atomic"]].copy()
-    if not stocks.empty:
-        s = stocks.copy(); s["Metric"]="Stocks"; prepared.append(s)
-
-    # CH4_CO2e
-    ch4 = long[long["ElementNorm"]=="CH4"][["Area","Item","Year","Value","item_kind","is_all_animals","is_atomic"]].copy()
-    if not ch4.empty:
-        ch4["Value"] = ch4["Value"] * GWP_CH4
-        ch4e = ch4.groupby(["Area","Item","Year","item_kind","is_all_animals","is_atomic"], as_index=False)["Value"].sum()
-        ch4e["Metric"]="CH4_CO2e"
-        prepared.append(ch4e)
-
-    # N2O_CO2e
-    n2o = long[long["ElementNorm"]=="N2O"][["Area","Item","Year","Value","item_kind","is_all_animals","is_atomic"]].copy()
-    if not n2o.empty:
-        n2o["Value"] = n2o["Value"] * GWP_N2O
-        n2oe = n2o.groupby(["Area","Item","Year","item_kind","is_all_animals","is_atomic"], as_index=False)["Value"].sum()
-        n2oe["Metric"]="N2O_CO2e"
-        prepared.append(n2oe)
-
-    # Total_CO2e
-    if not ch4.empty or not n2o.empty:
-        ch4e_sum = ch4.groupby(["Area","Item","Year","item_kind","is_all_animals","is_atomic"], as_index=False)["Value"].sum().rename(columns={"Value":"CH4_CO2e"})
-        n2oe_sum = n2o.groupby(["Area","Item","Year","item_kind","is_all_animals","is_atomic"], as_index=False)["Value"].sum().rename(columns={"Value":"N2O_CO2e"})
-        tot = pd.merge(ch4e_sum, n2oe_sum, on=["Area","Item","Year","item_kind","is_all_animals","is_atomic"], how="outer").fillna(0.0)
-        tot["Value"] = tot["CH4_CO2e"] + tot["N2O_CO2e"]
-        tot = tot.drop(columns=["CH4_CO2e","N2O_CO2e"])
-        tot["Metric"]="Total_CO2e"
-        prepared.append(tot)
-
-    # LSU from Stocks (with optional cattle split)
-    if not stocks.empty:
-        sb = stocks.rename(columns={"Value":"Stocks"}).copy()
-        if split_cattle:
-            mask = sb["Item"].apply(looks_like_cattle)
-            cattle = sb[mask].copy()
-            non_cattle = sb[~mask].copy()
-            if not cattle.empty:
-                dairy = cattle.copy(); dairy["Stocks"] *= dairy_frac
-                dairy["Item"] = dairy["Item"].astype(str).str.replace(r"(?i)cattle", "Cattle (dairy)", regex=True)
-                other = cattle.copy(); other["Stocks"] *= (1.0 - dairy_frac)
-                other["Item"] = other["Item"].astype(str).str.replace(r"(?i)cattle", "Cattle (other)", regex=True)
-                dairy["item_kind"] = "atomic"; dairy["is_atomic"] = True; dairy["is_all_animals"] = False
-                other["item_kind"] = "atomic"; other["is_atomic"] = True; other["is_all_animals"] = False
-                sb = pd.concat([non_cattle, dairy, other], ignore_index=True)
-
-        sb["LSU_weight"] = sb["Item"].apply(default_lsu_weight)
-        sb["Value"] = sb["Stocks"] * sb["LSU_weight"]
-        lsu = sb[["Area","Item","Year","Value","item_kind","is_all_animals","is_atomic"]].copy()
-        lsu["Metric"]="LSU"
-        prepared.append(lsu)
+    if stock_parts:
+        stock_keys = with_item_kind(concat_categorical([k for k, _ in stock_parts], ["Area","Item"]))
+        stocks = np.vstack([v for _, v in stock_parts])
+        prepared.append(wide_to_long(stock_keys, stocks, years, "Stocks", dtype=np.float64))
+
+    # CH4_CO2e / N2O_CO2e / Total_CO2e: one more reduction merges the per-chunk partial sums
+    if gas_parts:
+        gas_keys = concat_categorical([k for k, _ in gas_parts], ["Area","Item"])
+        first, sums = sum_by_group(area_item_codes(gas_keys), np.vstack([s for _, s in gas_parts]))
+        gas_keys = with_item_kind(gas_keys.iloc[first])
+        ch4e, n2oe = sums[:, :ny], sums[:, ny:2*ny]
+        for has, vals, metric in [(sums[:, -2] > 0, ch4e, "CH4_CO2e"), (sums[:, -1] > 0, n2oe, "N2O_CO2e")]:
+            if has.any():
+                prepared.append(wide_to_long(gas_keys[has], vals[has], years, metric))
+        prepared.append(wide_to_long(gas_keys, ch4e + n2oe, years, "Total_CO2e"))
+
+    # LSU from Stocks (with optional cattle split). Per-item factors fold the dairy share and
+    # the LSU weight of the renamed items, so every output row is one multiply by a table entry.
+    if stock_parts:
+        sb = stock_keys
+        item_codes = sb["Item"].cat.codes.to_numpy()
+        cats = [str(c) for c in sb["Item"].cat.categories]
+        dairy_name = lambda it: CATTLE_RE.sub("Cattle (dairy)", str(it))
+        other_name = lambda it: CATTLE_RE.sub("Cattle (other)", str(it))
+        is_cattle = np.array([split_cattle and looks_like_cattle(c) for c in cats], dtype=bool)
+        main_factor = np.array([dairy_frac * default_lsu_weight(dairy_name(c)) if cattle else default_lsu_weight(c)
+                                for c, cattle in zip(cats, is_cattle)], dtype=np.float64)
+        other_factor = np.array([(1.0 - dairy_frac) * default_lsu_weight(other_name(c)) for c in cats], dtype=np.float64)
+
+        mask = is_cattle[item_codes]
+        main, other_vals = lsu_values(stocks, item_codes, main_factor, other_factor, np.flatnonzero(mask))
+        if mask.any():
+            cattle = sb[mask]
+            dairy = cattle.copy()
+            dairy["Item"] = classify(cattle["Item"], dairy_name)
+            other = cattle.copy()
+            other["Item"] = classify(cattle["Item"], other_name)
+            dairy["item_kind"] = "atomic"; dairy["is_atomic"] = True; dairy["is_all_animals"] = False
+            other["item_kind"] = "atomic"; other["is_atomic"] = True; other["is_all_animals"] = False
+            sb = concat_categorical([sb[~mask], dairy, other], ["Item","item_kind"])
+            main = np.vstack([main[~mask], main[mask], other_vals])
+        prepared.append(wide_to_long(sb, main, years, "LSU", dtype=np.float64))
 
     if not prepared:
         sys.exit("Nothing to write.")
 
-    out = pd.concat(prepared, ignore_index=True)
-    out = out.sort_values(["Area","Item","Year","Metric"]).reset_index(drop=True)
+    # Gas metrics are float32, Stocks/LSU float64 (exact head counts); region totals are then
+    # summed and written in float64 so large aggregates are not rounded again
+    prepared = [f.assign(Value=as_float64(f["Value"])) for f in prepared]
+    out = concat_categorical(prepared, ["Item","item_kind","Metric"])
 
     # ---- Append group totals (per Item, Year, Metric) ----
-    def group_totals(df_long: pd.DataFrame, members: set[str], label: str) -> pd.DataFrame:
-        sub = df_long[df_long["Area"].isin(members)].copy()
+    # One (keys x Area) pivot serves every region through an Area x region membership matrix
+    def region_totals(df_long: pd.DataFrame, regions: dict[str, set[str]]) -> list[pd.DataFrame]:
+        keys = ["Item","Year","Metric","item_kind","is_all_animals","is_atomic"]
+        sub = df_long[df_long["Area"].isin(set().union(*regions.values()))]
         if sub.empty:
-            return sub
-        g = (sub.groupby(["Item","Year","Metric","item_kind","is_all_animals","is_atomic"], as_index=False)["Value"]
-                .sum())
-        g.insert(0, "Area", label)
-        return g
-
-    areas_available = set(out["Area"].unique().tolist())
-    eu = areas_available.intersection(EU)
-    eea = areas_available.intersection(EEA_PLUS_UK)
-    eur = areas_available.intersection(EUROPE_WIDE)
-
-    add = []
-    if eu:  add.append(group_totals(out, eu,  "EU (group total)"))
-    if eea: add.append(group_totals(out, eea, "EU/EEA+UK (group total)"))
-    if eur: add.append(group_totals(out, eur, "Europe (group total)"))
-    if add:
-        out = pd.concat([out] + add, ignore_index=True).sort_values(["Area","Item","Year","Metric"]).reset_index(drop=True)
-
-    out[["Area","Item","Year","Metric","Value","item_kind","is_all_animals","is_atomic"]].to_csv(outp, index=False)
-    print(f"Wrote prepared dataset (v3e, excludes 'Mules and hinnies' & 'Chickens') to: {outp}")
+            return []
+        g = sub.groupby(keys + ["Area"], observed=True)["Value"].agg(["sum","size"])
+        sums = g["sum"].unstack("Area", fill_value=0.0)
+        present = g["size"].unstack("Area", fill_value=0) > 0
+        membership = np.array([[a in m for m in regions.values()] for a in sums.columns], dtype=np.float64)
+        # Column-major so each region's totals are one contiguous column
+        totals = np.asfortranarray(sums.to_numpy(dtype=np.float64) @ membership)
+        hits = (present.to_numpy(dtype=np.float64) @ membership) > 0
+        key_frame = sums.index.to_frame(index=False)
+        res = []
+        for j, label in enumerate(regions):
+            if hits[:, j].any():
+                t = key_frame[hits[:, j]].reset_index(drop=True)
+                t.insert(0, "Area", label)
+                t["Value"] = totals[hits[:, j], j]
+                res.append(t)
+        return res
+
+    add = region_totals(out, {"EU (group total)": EU,
+                              "EU/EEA+UK (group total)": EEA_PLUS_UK,
+                              "Europe (group total)": EUROPE_WIDE})
+    out = concat_categorical([out] + add, ["Area","Item","item_kind","Metric"])
+    out = out.sort_values(["Area","Item","Year","Metric"]).reset_index(drop=True)
+
+    # Rebuilt as one contiguous 1-D array so to_csv/to_parquet read it sequentially
+    out["Value"] = np.ascontiguousarray(out["Value"].to_numpy(dtype=np.float64, na_value=np.nan))
+    out = out[["Area","Item","Year","Metric","Value","item_kind","is_all_animals","is_atomic"]]
+    out.to_csv(outp, index=False)
+    # Columnar sidecar: the Streamlit app loads this instead of re-parsing the CSV.
+    # Keys are written as plain strings (Parquet dictionary-encodes them on disk anyway)
+    # so the sidecar reads back with the same dtypes as the CSV, not as categoricals.
+    pq = outp.with_suffix(".parquet")
+    out.astype(dict.fromkeys(["Area","Item","Metric","item_kind"], str)).to_parquet(
+        pq, engine="pyarrow", compression="zstd", index=False)
+    print(f"Wrote prepared dataset (v3e, excludes 'Mules and hinnies' & 'Chickens') to: {outp} (+ {pq.name})")
 
 if __name__ == "__main__":
     main()
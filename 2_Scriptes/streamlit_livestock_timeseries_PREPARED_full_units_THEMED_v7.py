@@ -1,7 +1,10 @@
 
 from __future__ import annotations
 import streamlit as st, pandas as pd, altair as alt
+import numpy as np
 from pathlib import Path
+from _constants import EU, EEA_PLUS_UK, EUROPE_WIDE
+from _kernels import sum_by_code
 
 # Try to import plotly; if missing, we will show a helpful message in the Map tab.
 try:
@@ -12,7 +15,7 @@ try:
         [0.00, "#ABDDA4"],
         [0.11, "#66C2A5"],
         [0.22, "#3288BD"],
-        [0.33, "#5E4FA2"],
+        [0.33, "#5B44C3"],
         [0.44, "#FEE08B"],
         [0.56, "#FDAE61"],
         [0.67, "#F46D43"],
@@ -29,13 +32,6 @@ DEFAULT_PREPARED = "1_Donnees/livestock_PREPARED_long.csv"
 REGION_LABELS = ["Europe (group total)", "EU (group total)", "EU/EEA+UK (group total)"]
 REGION_SET = set(REGION_LABELS)
 
-EUROPE_WIDE = {"Albania","Andorra","Armenia","Austria","Azerbaijan","Belarus","Belgium","Bosnia and Herzegovina","Bulgaria",
-               "Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia","Finland","France","Georgia","Germany","Greece",
-               "Hungary","Iceland","Ireland","Italy","Kazakhstan","Kosovo","Latvia","Liechtenstein","Lithuania","Luxembourg",
-               "Malta","Moldova","Monaco","Montenegro","Netherlands","North Macedonia","Norway","Poland","Portugal","Romania",
-               "Russia","San Marino","Serbia","Slovakia","Slovenia","Spain","Sweden","Switzerland","Turkey","Ukraine",
-               "United Kingdom","UK","Vatican City"}
-
 
 # ---------- Corporate palette & theming ----------
 CORP = {
@@ -48,22 +44,22 @@ CORP = {
 }
 
 # 1) Streamlit CSS (backgrounds, sidebar, buttons, tabs)
-st.markdown(f'''
+CORP_CSS_TEMPLATE = '''
 <style>
 /* App background */
 .stApp {{
-  background-color: {CORP["bg"]};
-  color: {CORP["text"]};
+  background-color: {bg};
+  color: {text};
 }}
 
 /* Sidebar background */
 section[data-testid="stSidebar"] > div:first-child {{
-  background-color: {CORP["panel"]} !important;
+  background-color: {panel} !important;
 }}
 
 /* Buttons & downloads */
 .stButton button, .stDownloadButton button {{
-  background-color: {CORP["accent"]} !important;
+  background-color: {accent} !important;
   color: white !important;
   border: 0 !important;
   border-radius: 10px !important;
@@ -74,10 +70,10 @@ section[data-testid="stSidebar"] > div:first-child {{
 
 /* Tabs */
 .stTabs [role="tablist"] button[role="tab"] {{
-  color: {CORP["text"]};
+  color: {text};
 }}
 .stTabs [role="tablist"] button[aria-selected="true"] {{
-  border-bottom: 3px solid {CORP["accent"]};
+  border-bottom: 3px solid {accent};
 }}
 
 /* Cards/panels */
@@ -87,13 +83,12 @@ section[data-testid="stSidebar"] > div:first-child {{
 
 /* Inputs labels */
 label, .stSelectbox label, .stRadio label {{
-  color: {CORP["text"]} !important;
+  color: {text} !important;
 }}
 </style>
-''', unsafe_allow_html=True)
+'''
 
 # 2) Altair theme
-import altair as alt
 ALT_CATEGORY = ["#9E0142","#D53E4F","#F46D43","#FDAE61","#FEE08B","#E6F598","#ABDDA4","#66C2A5","#3288BD","#5E4FA2","#9E0142","#D53E4F","#F46D43","#FDAE61","#FEE08B","#E6F598","#ABDDA4","#66C2A5","#3288BD","#5E4FA2","#9E0142","#D53E4F","#F46D43","#FDAE61","#FEE08B","#E6F598","#ABDDA4","#66C2A5","#3288BD","#5E4FA2","#9E0142","#D53E4F","#F46D43","#FDAE61","#FEE08B","#E6F598","#ABDDA4","#66C2A5","#3288BD","#5E4FA2"]
 def _corp_altair_theme():
     return {
@@ -105,37 +100,22 @@ def _corp_altair_theme():
             "title": {"color": CORP["text"]}, "mark": {"strokeWidth": 2} ,
         }
     }
-alt.themes.register("corp", _corp_altair_theme)
-alt.themes.enable("corp")
+
+@st.cache_resource
+def _init_theme() -> tuple[str, str]:
+    # Once per process: render the CSS and register the Altair theme (registering appends to altair's registry).
+    alt.themes.register("corp", _corp_altair_theme)
+    return CORP_CSS_TEMPLATE.format(**CORP), "corp"
+
+CORP_CSS, CORP_THEME = _init_theme()
+st.markdown(CORP_CSS, unsafe_allow_html=True)
+alt.themes.enable(CORP_THEME)
 
 # --- Reduced palette for pie charts: 7 evenly spaced colors from the user palette ---
 USER_PLOT_PALETTE = ["#9E0142","#D53E4F","#F46D43","#FDAE61","#FEE08B","#E6F598","#ABDDA4","#66C2A5","#3288BD","#5E4FA2"]
 PIE_COLORS_COUNT = 7
-PIE_IDX = [round(i*(len(USER_PLOT_PALETTE)-1)/(PIE_COLORS_COUNT-1)) for i in range(PIE_COLORS_COUNT)]
-PIE_PALETTE = [USER_PLOT_PALETTE[i] for i in PIE_IDX]
-
-
-# Reduced palette for pie charts (fewer colors, still spanning endpoints)
-PIE_PALETTE = ["#9E0142","#F46D43","#FEE08B","#ABDDA4","#3288BD","#5E4FA2"]
-
-# 3) Plotly theme utilities
-try:
-    import plotly.express as px
-    HAS_PLOTLY = True
-    # Green (low) -> Teal/Blue -> Yellow -> Orange -> Red (high)
-    CORP_SCALE = [
-        [0.00, "#ABDDA4"],
-        [0.11, "#66C2A5"],
-        [0.22, "#3288BD"],
-        [0.33, "#5B44C3"],
-        [0.44, "#FEE08B"],
-        [0.56, "#FDAE61"],
-        [0.67, "#F46D43"],
-        [0.78, "#D53E4F"],
-        [1.00, "#9E0142"]
-    ]
-except Exception:
-    HAS_PLOTLY = False
+PIE_IDX = np.linspace(0, len(USER_PLOT_PALETTE)-1, PIE_COLORS_COUNT).round().astype(int)
+PIE_PALETTE = np.take(USER_PLOT_PALETTE, PIE_IDX).tolist()
 
 
 def metric_unit_label(metric: str) -> str:
@@ -147,26 +127,120 @@ def metric_unit_label(metric: str) -> str:
     if metric == "Stocks":     return "Headcount (head)"
     return metric
 
-@st.cache_data
 def load_prepared(path: Path) -> pd.DataFrame:
-    df = pd.read_csv(path)
+    # Uncached: load_partitions caches the partitions built from it, a second copy would never be read.
+    # Prefer the Parquet sidecar written by the preprocessor when it is at least as fresh as the CSV
+    pq = path.with_suffix(".parquet")
+    if pq.exists() and pq.stat().st_mtime >= path.stat().st_mtime:
+        df = pd.read_parquet(pq)
+    else:
+        df = pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow")
     need = {"Area","Item","Year","Metric","Value","item_kind","is_all_animals","is_atomic"}
     miss = need.difference(df.columns)
     if miss:
         st.error(f"Prepared CSV missing columns: {', '.join(sorted(miss))}"); st.stop()
+    return categorize(df)
+
+def categorize(df: pd.DataFrame) -> pd.DataFrame:
+    # Low-cardinality labels as categoricals: unique-value lists, sorting and membership tests
+    # then run over the small category dictionary instead of every row
     df["item_kind"] = df["item_kind"].astype(str)
+    for c in ["Area","Item","Metric","item_kind"]:
+        df[c] = df[c].astype("category").cat.remove_unused_categories()
     return df
 
+def partition(df: pd.DataFrame) -> dict[tuple[str, str], pd.DataFrame]:
+    # Split once per (Metric, item_kind), each part sorted by (Area, Year), so a widget
+    # change only scans the rows of the selected partition instead of the whole table
+    df = df.sort_values(["Metric","item_kind","Area","Year"], kind="stable")
+    return {(str(m), str(k)): part.reset_index(drop=True)
+            for (m, k), part in df.groupby(["Metric","item_kind"], observed=True, sort=False)}
+
+@st.cache_resource
+def load_partitions(path: Path) -> dict[tuple[str, str], pd.DataFrame]:
+    # Shared read-only across reruns (cache_resource: no per-rerun copy of every partition)
+    return partition(load_prepared(path))
+
+def data_bounds(parts: dict[tuple[str, str], pd.DataFrame]) -> tuple[int, int, list[str]]:
+    # Year range and Area list for the widgets; the partitions all share df's Area categories
+    years = [(p["Year"].min(), p["Year"].max()) for p in parts.values()]
+    areas = next(iter(parts.values()))["Area"].cat.categories
+    return int(min(y for y, _ in years)), int(max(y for _, y in years)), sorted(areas.tolist())
+
+@st.cache_resource
+def load_bounds(path: Path) -> tuple[int, int, list[str]]:
+    # Reruns read these from here rather than rescanning the partitions
+    return data_bounds(load_partitions(path))
+
+def build_cubes(parts: dict[tuple[str, str], pd.DataFrame]) -> dict[str, pd.Series]:
+    # Pre-summed, sorted MultiIndex series for the pie (Metric, Year, Area, Item) and the
+    # map (Metric, Year, Area): slider ticks become index lookups instead of groupbys
+    def cube(item_kind: str, levels: list[str]) -> pd.Series:
+        frames = [p for (m, k), p in parts.items() if k == item_kind]
+        if not frames:
+            return pd.Series(dtype="float64", index=pd.MultiIndex.from_arrays([[]] * len(levels), names=levels))
+        return pd.concat(frames).groupby(levels, observed=True)["Value"].sum().sort_index()
+    return {"pie": cube("aggregate", ["Metric","Year","Area","Item"]),
+            "map": cube("all_animals", ["Metric","Year","Area"])}
+
+@st.cache_resource
+def load_cubes(path: Path) -> dict[str, pd.Series]:
+    return build_cubes(load_partitions(path))
+
+@st.cache_resource
+def load_uploaded(file_id: str, _file) -> tuple[dict, tuple[int, int, list[str]], dict[str, pd.Series]]:
+    # Same prepared structures as the disk path, built once per uploaded file (keyed on its file_id)
+    parts = partition(categorize(pd.read_csv(_file)))
+    return parts, data_bounds(parts), build_cubes(parts)
+
+def cube_slice(cube: pd.Series, *key) -> pd.Series:
+    try:
+        return cube.loc[key]
+    except KeyError:
+        return cube.iloc[:0]
+
+def area_year_totals(sub: pd.DataFrame) -> pd.DataFrame:
+    # Same result as groupby(["Area","Year"])["Value"].sum(), but the key space is tiny
+    # (areas x years), so one np.bincount over flattened codes is much cheaper
+    area_codes, areas = pd.factorize(sub["Area"], sort=True)
+    years = sub["Year"].to_numpy(dtype=np.int64)
+    y0 = years.min(); n_years = years.max() - y0 + 1
+    key = area_codes * n_years + (years - y0)
+    values = np.nan_to_num(sub["Value"].to_numpy(dtype=np.float64, na_value=np.nan))
+    sums = np.bincount(key, weights=values, minlength=len(areas) * n_years)
+    cells = np.flatnonzero(np.bincount(key, minlength=len(areas) * n_years))
+    return pd.DataFrame({"Area": areas.take(cells // n_years), "Year": y0 + cells % n_years, "SeriesValue": sums[cells]})
+
+@st.cache_data
+def top_countries(data_key: str, _parts, metric: str, item_kind: str, items: tuple[str, ...],
+                  pool: tuple[str, ...], year: int, n: int = 10) -> list[str]:
+    # Preset ranking depends only on the selection, so unchanged selections are a cache hit.
+    # Areas are summed on factorized codes and the top n picked with an O(areas) argpartition.
+    part = _parts[(metric, item_kind)]
+    latest = part[(part["Year"]==year) & part["Area"].isin(pool) & part["Item"].isin(items)]
+    if latest.empty:
+        return []
+    codes, areas = pd.factorize(latest["Area"], sort=True)
+    sums = sum_by_code(codes.astype(np.int64), latest["Value"].to_numpy(dtype=np.float64, na_value=np.nan), len(areas))
+    k = min(n, len(areas))
+    top = np.argpartition(-sums, k - 1)[:k]
+    top = top[np.lexsort((top, -sums[top]))]
+    return [str(a) for a in areas.take(top)]
+
 path = Path(DEFAULT_PREPARED)
 if not path.exists():
     st.warning(f"Prepared CSV not found at:\n{path}\nUpload below or update DEFAULT_PREPARED.")
     uploaded = st.file_uploader("Upload the prepared CSV", type=["csv"])
     if uploaded is None: st.stop()
-    df = pd.read_csv(uploaded)
+    data_key = getattr(uploaded, "file_id", uploaded.name)
+    parts, (year_min, year_max, AREAS), cubes = load_uploaded(data_key, uploaded)
 else:
-    df = load_prepared(path)
+    parts = load_partitions(path)
+    year_min, year_max, AREAS = load_bounds(path)
+    cubes = load_cubes(path)
+    data_key = str(path)
+METRICS = sorted({m for m, _ in parts})
 
-year_min, year_max = int(df["Year"].min()), int(df["Year"].max())
 DEFAULT_START = max(1990, year_min)
 DEFAULT_END   = min(2022, year_max)
 
@@ -179,8 +253,8 @@ tab_ts, tab_pie, tab_map = st.tabs(["Time trends", "Composition", "Map"])
 with tab_ts:
     with st.sidebar:
         st.header("Metric & period")
-        metric = st.selectbox("Metric", sorted(df["Metric"].unique().tolist()),
-                              index=sorted(df["Metric"].unique().tolist()).index("Total_CO2e") if "Total_CO2e" in df["Metric"].unique() else 0)
+        metric = st.selectbox("Metric", METRICS,
+                              index=METRICS.index("Total_CO2e") if "Total_CO2e" in METRICS else 0)
         year_range = st.slider("Year range", min_value=year_min, max_value=year_max,
                                value=(DEFAULT_START, DEFAULT_END), step=1)
 
@@ -189,7 +263,7 @@ with tab_ts:
         group = st.radio("Choose one group", ["All animals","Aggregate","Atomic"], index=0, horizontal=False)
     group_key = {"All animals":"all_animals", "Aggregate":"aggregate", "Atomic":"atomic"}[group]
 
-    subset = df[(df["Metric"]==metric) & (df["item_kind"]==group_key)]
+    subset = parts.get((metric, group_key), next(iter(parts.values())).iloc[:0])
     items_all = sorted(subset["Item"].dropna().unique().tolist())
 
     ITEMS_KEY = "items_prepared_multiselect_by_group"
@@ -226,7 +300,7 @@ with tab_ts:
         show_region = st.checkbox("Show regional total instead of countries", value=False)
         region_choice = st.selectbox("Region total", REGION_LABELS, index=0, disabled=not show_region)
 
-    base = df[(df["Metric"]==metric) & (df["Year"]>=year_range[0]) & (df["Year"]<=year_range[1]) & (df["item_kind"]==group_key)]
+    base = subset[(subset["Year"]>=year_range[0]) & (subset["Year"]<=year_range[1])]
     base = base[base["Item"].isin(items)]
     if base.empty: st.info("No data for current filters."); st.stop()
 
@@ -234,26 +308,14 @@ with tab_ts:
         sub = base[base["Area"] == region_choice].copy()
         if sub.empty:
             st.info(f"No region total rows found for: {region_choice}. Did you run the latest preprocessor?"); st.stop()
-        totals = sub.groupby(["Area","Year"], as_index=False)["Value"].sum().rename(columns={"Value":"SeriesValue"})
+        totals = area_year_totals(sub)
     else:
-        EU = {"Austria","Belgium","Bulgaria","Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia",
-              "Finland","France","Germany","Greece","Hungary","Ireland","Italy","Latvia","Lithuania","Luxembourg",
-              "Malta","Netherlands","Poland","Portugal","Romania","Slovakia","Slovenia","Spain","Sweden"}
-        EEA_PLUS_UK = EU.union({"Iceland","Liechtenstein","Norway","United Kingdom","UK"})
-        EUROPE_WIDE = {"Albania","Andorra","Armenia","Austria","Azerbaijan","Belarus","Belgium","Bosnia and Herzegovina","Bulgaria",
-                       "Croatia","Cyprus","Czechia","Czech Republic","Denmark","Estonia","Finland","France","Georgia","Germany","Greece",
-                       "Hungary","Iceland","Ireland","Italy","Kazakhstan","Kosovo","Latvia","Liechtenstein","Lithuania","Luxembourg",
-                       "Malta","Moldova","Monaco","Montenegro","Netherlands","North Macedonia","Norway","Poland","Portugal","Romania",
-                       "Russia","San Marino","Serbia","Slovakia","Slovenia","Spain","Sweden","Switzerland","Turkey","Ukraine",
-                       "United Kingdom","UK","Vatican City"}
-        def intersect_available(names_set: set[str], available: set[str]) -> list[str]:
-            return sorted(list(available.intersection(names_set)))
         with st.sidebar:
             st.header("Countries")
             mode = st.radio("Country selection mode", ["Preset (Top 10)", "Custom (pick countries)"], horizontal=False)
             add_ch = False
             preset_choice = None
-            available_countries = sorted(df["Area"].dropna().unique().tolist())
+            available_countries = AREAS
             if mode == "Preset (Top 10)":
                 preset_choice = st.selectbox("Preset group", ["Europe", "EU", "EU/EEA + UK"], index=0)
                 add_ch = st.checkbox("Add Switzerland 🇨🇭", value=False)
@@ -267,10 +329,8 @@ with tab_ts:
             if preset_choice == "Europe": pool = inter(EUROPE_WIDE)
             elif preset_choice == "EU":   pool = inter(EU)
             else:                         pool = inter(EEA_PLUS_UK)
-            latest_year = sub["Year"].max()
-            latest = sub[(sub["Year"]==latest_year) & (sub["Area"].isin(pool))]
-            ranked = latest.groupby("Area", as_index=False)["Value"].sum().sort_values("Value", ascending=False)["Area"].tolist()
-            keep = ranked[:10]
+            latest_year = int(sub["Year"].max())
+            keep = top_countries(data_key, parts, metric, group_key, tuple(items), tuple(pool), latest_year)
             if add_ch and "Switzerland" in available_countries and "Switzerland" not in keep:
                 keep.append("Switzerland")
         else:
@@ -278,7 +338,7 @@ with tab_ts:
 
         if keep: sub = sub[sub["Area"].isin(keep)]
         if sub.empty: st.info("No data after country selection."); st.stop()
-        totals = sub.groupby(["Area","Year"], as_index=False)["Value"].sum().rename(columns={"Value":"SeriesValue"})
+        totals = area_year_totals(sub)
 
     labels = {"Stocks":"Headcount (stocks)","CH4_CO2e":"CH₄ (kt CO₂e)","N2O_CO2e":"N₂O (kt CO₂e)","Total_CO2e":"Total (kt CO₂e)","LSU":"Livestock Units (LSU)"}
     y_label = labels.get(metric, metric)
@@ -316,16 +376,16 @@ with tab_pie:
     metric_pie = st.selectbox("Pie metric", ["Total_CO2e","CH4_CO2e","N2O_CO2e"], index=0)
     year_pie = st.slider("Pie year", min_value=year_min, max_value=year_max, value=min(2022, year_max), step=1)
 
-    agg = df[(df["item_kind"]=="aggregate") & (df["Metric"]==metric_pie) & (df["Year"]==year_pie)].copy()
+    agg = cube_slice(cubes["pie"], metric_pie, year_pie)
     if agg.empty:
         st.info("No aggregate rows found for that year/metric."); st.stop()
 
-    areas = sorted(agg["Area"].unique().tolist())
+    areas = sorted(agg.index.unique("Area").tolist())
     regions_first = [x for x in REGION_LABELS if x in areas]
     countries = [a for a in areas if a not in regions_first]
     area_choice = st.selectbox("Choose country/region", regions_first + countries, index=0 if regions_first else 0)
 
-    pie_df = agg[agg["Area"]==area_choice][["Item","Value"]].groupby("Item", as_index=False)["Value"].sum()
+    pie_df = cube_slice(agg, area_choice).rename_axis("Item").reset_index(name="Value")
     total_val = float(pie_df["Value"].sum()) if not pie_df.empty else 0.0
 
     if total_val <= 0 or pie_df.empty:
@@ -367,22 +427,23 @@ with tab_map:
         st.error("Plotly is not installed. In a terminal, run:\n\n  py -m pip install plotly\n\nThen rerun the app.")
         st.stop()
 
-    sub = df[(df["item_kind"]=="all_animals") & (df["Metric"]==metric_map) & (df["Year"]==year_map)].copy()
-    sub = sub[~sub["Area"].isin(REGION_SET)].copy()
+    sub = cube_slice(cubes["map"], metric_map, year_map)
+    sub = sub[~sub.index.isin(REGION_SET)]
 
-    available = set(sub["Area"].unique().tolist())
+    available = set(sub.index.tolist())
     europe_names = sorted(list(available.intersection(EUROPE_WIDE)))
     if not europe_names:
         st.info("No European country rows found for this selection."); st.stop()
-    sub = sub[sub["Area"].isin(europe_names)]
+    sub = sub[sub.index.isin(europe_names)]
 
-    map_df = sub.groupby(["Area"], as_index=False)["Value"].sum()
+    map_df = sub.rename_axis("Area").reset_index(name="Value")
 
     name_fix = {
         "UK": "United Kingdom",
         "Russia": "Russian Federation",
     }
-    map_df["Area"] = map_df["Area"].replace(name_fix)
+    # Area is categorical (Parquet/categorize), so rename on plain strings: the fixed names are new labels
+    map_df["Area"] = map_df["Area"].astype(str).replace(name_fix)
 
     label = "Total (kt CO₂e)" if metric_map=="Total_CO2e" else "Livestock Units (LSU)"
     fig = px.choropleth(